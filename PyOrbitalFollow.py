@@ -13,7 +13,9 @@ import requests
 import json
 import hashlib
 import pytz
+import numpy
 import skyfield.api # https://rhodesmill.org/skyfield/api.html#earth-satellites
+import PyPassIndex
 
 ThisPath    = os.path.dirname(__file__)+'/'
 ConfigPath  = ThisPath+'config/'
@@ -426,11 +428,46 @@ def PrepareData(v_SaveFiles=False):
     return SatMapConfigActiveArray
 
 
-def CalcPassages(v_SatelliteData=None, v_StationData=None, v_dtRefDateTime=datetime.datetime.now().date()):
+def LoadHorizonMask(v_StationData):
+    global ConfigPath
+
+    # "HorizonMask" is a list of minimum elevations (degrees), one per equal
+    # azimuth bin starting at North (0 deg); it can be given inline or as a
+    # JSON file name inside the config folder. "MinDegree" is the mask floor.
+    MinDegree   = v_StationData['MinDegree']
+    HorizonMask = v_StationData.get('HorizonMask', None)
+    if (isinstance(HorizonMask, str)):
+        with open(ConfigPath+HorizonMask, 'r') as fHorizonMask:
+            HorizonMask = json.load(fHorizonMask)
+    if ((HorizonMask is None) or (len(HorizonMask) == 0)):
+        HorizonMask = [MinDegree]
+
+    return numpy.maximum(numpy.array(HorizonMask, dtype=float), MinDegree)
+
+
+def ApplyHorizonMask(v_HorizonMask, v_AltDegrees, v_AzDegrees):
+    QtyBins = len(v_HorizonMask)
+    BinIdx  = numpy.floor(numpy.asarray(v_AzDegrees) * QtyBins / 360.0).astype(int) % QtyBins
+    return numpy.asarray(v_AltDegrees) > v_HorizonMask[BinIdx]
+
+
+def MaskedRuns(v_Visible):
+    # First and last index (inclusive) of each run of visible samples
+    Edges = numpy.diff(numpy.asarray(v_Visible, dtype=numpy.int8), prepend=0, append=0)
+    return list(zip(numpy.flatnonzero(Edges == 1), numpy.flatnonzero(Edges == -1) - 1))
+
+
+def TimeScaleOffsets(v_TimeScale, v_dtUtcStart, v_Offsets):
+    dtUtc = v_dtUtcStart
+    return v_TimeScale.utc(dtUtc.year, dtUtc.month, dtUtc.day, dtUtc.hour, dtUtc.minute, dtUtc.second + dtUtc.microsecond / 1e6 + v_Offsets)
+
+
+def CalcPassages(v_SatelliteData=None, v_StationData=None, v_dtRefDateTime=datetime.datetime.now().date(), v_HorizonMask=None):
     TleData         = v_SatelliteData['SatData']
     MiliSecStep     = v_SatelliteData['SatTrackingConfig']['TrackingStepMS']
     SecJumpStep     = v_SatelliteData['SatTrackingConfig']['WindowJumpSec']
     LocationData    = v_StationData['LocationData']
+    HorizonMask     = LoadHorizonMask(v_StationData) if v_HorizonMask is None else v_HorizonMask
 
     dtStart         = v_dtRefDateTime
     dtTimeStart     = datetime.datetime(dtStart.year,dtStart.month,dtStart.day,0,0,0)
@@ -443,112 +480,93 @@ def CalcPassages(v_SatelliteData=None, v_StationData=None, v_dtRefDateTime=datet
     Location        = skyfield.api.wgs84.latlon(LocationData['Latitude'],LocationData['Longitude'],LocationData['Altitude'])
     TimeZone        = pytz.timezone(LocationData['TimeZone'])
     LocDiff         = EarthSat - Location
-  # MaxIterations   = round((dtTimeEnd - dtTimeStart).total_seconds() * 1000 / MiliSecStep)
-    print('Calculating For "'+LocationData['Name']+'" "'+v_SatelliteData['TleName']+'" "'+TleData['Name']+'"; Date '+v_dtRefDateTime.isoformat()+'; Step '+str(MiliSecStep)+'ms; MinDegree '+str(v_StationData['MinDegree']))
-
-    dtTimeLoop      = dtTimeStart
-    LoopStep        = datetime.timedelta(milliseconds=MiliSecStep)
-    IsVisible       = False
-    WindowVisible   = False
-    MachineState    = None
-    PassageSequence = 0
-    WindowSequence  = 0
+    print('Calculating For "'+LocationData['Name']+'" "'+v_SatelliteData['TleName']+'" "'+TleData['Name']+'"; Date '+v_dtRefDateTime.isoformat()+'; Step '+str(MiliSecStep)+'ms; MinDegree '+str(v_StationData['MinDegree'])+'; HorizonBins '+str(len(HorizonMask)))
+
+    dtDayStart      = TimeZone.localize(dtTimeStart)
+    dtUtcStart      = dtDayStart.astimezone(pytz.utc)
+    DaySeconds      = (TimeZone.localize(dtTimeEnd) - dtDayStart).total_seconds()
+    StepSeconds     = MiliSecStep / 1000.0
+    ScanSeconds     = 300
     WindowId        = 1
-    WindowStart     = None
-    WindowEnd       = None
-    SatApexDegree   = 0
-    SatApexTime     = None
-
-    while dtTimeLoop <= dtTimeEnd:
-        dtThisLoop      = TimeZone.localize(dtTimeLoop)
-        tsStart         = dtTimeScale.utc(dtThisLoop)
-        GeoCentric      = EarthSat.at(tsStart)
-        TopoCentric     = LocDiff.at(tsStart)
-        IsPassing       = False
-        lat, lon        = skyfield.api.wgs84.latlon_of(GeoCentric)
-        alt, az, dist   = TopoCentric.altaz()
-        CalcDegress     = alt.degrees
-        PassageSequence += 1
-        WindowEnd       = None
-
-        # State Machine
-        if ((CalcDegress <= 0) and (not WindowVisible) and (not IsVisible)):
-            MachineState = 'A'
-            LoopStep = datetime.timedelta(minutes=5)
-        elif ((CalcDegress > 0) and (not WindowVisible) and (not IsVisible)):
-            MachineState    = 'B'
-            WindowVisible   = True
-            dtTimeLoop     -= datetime.timedelta(minutes=5)
-            LoopStep        = datetime.timedelta(milliseconds=MiliSecStep)
-        elif ((CalcDegress <= 0) and (WindowVisible) and (IsVisible)):
-            if (MachineState == 'E'):
-                WindowEnd       = dtThisLoop - datetime.timedelta(milliseconds=MiliSecStep)
-                jPositionMetaData = {
-                    'dtPassageDate':    v_dtRefDateTime.isoformat(),
-                    'StationId':        LocationData['Id'],
-                    'TleName':          v_SatelliteData['TleName'],
-                    'SatName':          v_SatelliteData['SatName'],
-                    'SatNum':           v_SatelliteData['SatNum'],
-                    'TleHash':          v_SatelliteData['SatHash'],
-                    'WindowId':         WindowId,
-                    'WindowSteps':      WindowSequence,
-                    'WindowStart':      WindowStart.isoformat(timespec='microseconds'),
-                    'WindowEnd':        WindowEnd.isoformat(timespec='microseconds'),
-                    'SatApexDegree':    SatApexDegree,
-                    'SatApexTime':      SatApexTime.isoformat(timespec='microseconds')
-                }
-                SatPOSMetadata.append(jPositionMetaData)
-
-                WindowSequence  = 0
-                WindowVisible   = False
-                WindowId       += 1
-                SatApexDegree   = 0
-                SatApexTime     = None
-                dtTimeLoop     += datetime.timedelta(seconds=SecJumpStep)
-                LoopStep        = datetime.timedelta(minutes=5)
-            MachineState = 'C'
-        elif ((CalcDegress <= 0) and (WindowVisible) and (not IsVisible)):
-            MachineState = 'D'
-        elif ((CalcDegress > 0) and (WindowVisible)):
-            MachineState = 'E'
-            WindowSequence += 1
-            IsPassing = True
-            if (WindowSequence == 1):
-                WindowStart = dtThisLoop
-
-        # Set Visibliity For Next Loop Iteration
-        if (CalcDegress > 0):
-            IsVisible = True
-        else:
-            IsVisible = False
+    NextScanOffset  = 0
 
-        dtTimeLoop += LoopStep
+    ### Coarse Scan (Whole Day, Geometric Visibility Only)
+    # A pass may clear the mask for less than ScanSeconds, so the mask is only
+    # applied to the fine samples; the coarse scan just picks what to refine.
+    ScanOffsets     = numpy.append(numpy.arange(0, DaySeconds, ScanSeconds), DaySeconds)
+    ScanAlt, ScanAz, ScanDist = LocDiff.at(TimeScaleOffsets(dtTimeScale, dtUtcStart, ScanOffsets)).altaz()
+    ScanVisible     = ScanAlt.degrees > 0
 
-        if (IsPassing):
-            if (CalcDegress > SatApexDegree):
-                SatApexDegree = CalcDegress
-                SatApexTime = dtThisLoop
+    for ScanFirst, ScanLast in MaskedRuns(ScanVisible):
+        if (ScanOffsets[ScanLast] < NextScanOffset):
+            continue
 
-            jPositionData = {
-                'PassageSequence':  PassageSequence,
-                'WindowSequence':   WindowSequence,
+        ### Fine Scan (Only Around Visible Coarse Samples, Horizon Mask Applied)
+        BracketStart    = max(ScanOffsets[max(ScanFirst - 1, 0)], NextScanOffset)
+        BracketEnd      = ScanOffsets[min(ScanLast + 1, len(ScanOffsets) - 1)]
+        FineSteps       = numpy.arange(numpy.ceil(BracketStart / StepSeconds), numpy.floor(BracketEnd / StepSeconds) + 1, dtype=numpy.int64)
+        FineTimes       = TimeScaleOffsets(dtTimeScale, dtUtcStart, FineSteps * StepSeconds)
+        alt, az, dist   = LocDiff.at(FineTimes).altaz()
+        AltDegrees      = alt.degrees
+        AzDegrees       = az.degrees
+        DistKm          = dist.km
+        FineVisible     = ApplyHorizonMask(HorizonMask, AltDegrees, AzDegrees)
+
+        for First, Last in MaskedRuns(FineVisible):
+            lat, lon        = skyfield.api.wgs84.latlon_of(EarthSat.at(FineTimes[First:Last + 1]))
+            LatDegrees      = lat.degrees
+            LonDegrees      = lon.degrees
+            WindowSequence  = 0
+            for Idx in range(First, Last + 1):
+                WindowSequence += 1
+                PassageSequence = int(FineSteps[Idx]) + 1
+                dtThisLoop      = TimeZone.normalize(dtDayStart + datetime.timedelta(milliseconds=int(FineSteps[Idx]) * MiliSecStep))
+                jPositionData = {
+                    'PassageSequence':  PassageSequence,
+                    'WindowSequence':   WindowSequence,
+                    'WindowId':         WindowId,
+                    'DateTime':         dtThisLoop.isoformat(timespec='microseconds'),
+                    'Degress':          float(AltDegrees[Idx]),
+                    'DistanceKm':       float(DistKm[Idx]),
+                    'Azimuth':          float(AzDegrees[Idx]),
+                    'AzimuthArcSec':    float(AzDegrees[Idx]) * 3600.0,
+                    'Altitude':         float(AltDegrees[Idx]),
+                    'AltitudeArcSec':   float(AltDegrees[Idx]) * 3600.0,
+                    'Latitude':         float(LatDegrees[Idx - First]),
+                    'LatitudeArcSec':   float(LatDegrees[Idx - First]) * 3600.0,
+                    'Longitude':        float(LonDegrees[Idx - First]),
+                    'LongitudeArcSec':  float(LonDegrees[Idx - First]) * 3600.0
+                }
+                jPositionData['_id'] = str(v_SatelliteData['SatHash'])+'_'+str(PassageSequence).zfill(10)
+                jPositionData['_insert_ts'] = int(datetime.datetime.now(datetime.UTC).timestamp())
+                jPositionData['_dt_insert'] = datetime.datetime.now(datetime.UTC).astimezone().isoformat()
+                SatPOSDocArray.append(jPositionData)
+
+            ApexIdx     = First + int(numpy.argmax(AltDegrees[First:Last + 1]))
+            WindowStart = TimeZone.normalize(dtDayStart + datetime.timedelta(milliseconds=int(FineSteps[First]) * MiliSecStep))
+            WindowEnd   = TimeZone.normalize(dtDayStart + datetime.timedelta(milliseconds=int(FineSteps[Last]) * MiliSecStep))
+            SatApexTime = TimeZone.normalize(dtDayStart + datetime.timedelta(milliseconds=int(FineSteps[ApexIdx]) * MiliSecStep))
+            jPositionMetaData = {
+                'dtPassageDate':    v_dtRefDateTime.isoformat(),
+                'StationId':        LocationData['Id'],
+                'TleName':          v_SatelliteData['TleName'],
+                'SatName':          v_SatelliteData['SatName'],
+                'SatNum':           v_SatelliteData['SatNum'],
+                'TleHash':          v_SatelliteData['SatHash'],
                 'WindowId':         WindowId,
-                'DateTime':         dtThisLoop.isoformat(timespec='microseconds'),
-                'Degress':          CalcDegress,
-                'DistanceKm':       dist.km,
-                'Azimuth':          az.degrees,
-                'AzimuthArcSec':    az.arcseconds(),
-                'Altitude':         alt.degrees,
-                'AltitudeArcSec':   alt.arcseconds(),
-                'Latitude':         lat.degrees,
-                'LatitudeArcSec':   lat.arcseconds(),
-                'Longitude':        lon.degrees,
-                'LongitudeArcSec':  lon.arcseconds()
+                'WindowSteps':      WindowSequence,
+                'WindowStart':      WindowStart.isoformat(timespec='microseconds'),
+                'WindowEnd':        WindowEnd.isoformat(timespec='microseconds'),
+                'SatApexDegree':    float(AltDegrees[ApexIdx]),
+                'SatApexTime':      SatApexTime.isoformat(timespec='microseconds')
             }
-            jPositionData['_id'] = str(v_SatelliteData['SatHash'])+'_'+str(PassageSequence).zfill(10)
-            jPositionData['_insert_ts'] = int(datetime.datetime.now(datetime.UTC).timestamp())
-            jPositionData['_dt_insert'] = datetime.datetime.now(datetime.UTC).astimezone().isoformat()
-            SatPOSDocArray.append(jPositionData)
+            SatPOSMetadata.append(jPositionMetaData)
+            WindowId += 1
+
+        # Resume After The Geometric Pass Ends Plus WindowJumpSec
+        AboveHorizon = numpy.flatnonzero(AltDegrees > 0)
+        if (len(AboveHorizon)):
+            NextScanOffset = FineSteps[AboveHorizon[-1]] * StepSeconds + SecJumpStep
 
     # Sort Output
     SatPOSDocArray = sorted(SatPOSDocArray, key=lambda DictItem:(DictItem['PassageSequence']))
@@ -563,11 +581,20 @@ def MainProcess():
     dtLoopStart = datetime.datetime.now().date()
     dtLoopEnd   = (dtLoopStart.replace(day=28) + datetime.timedelta(days=4)).replace(day=1) - datetime.timedelta(days=1)
     dtLoopEnd   = dtLoopStart
+    AllWindows  = []
+    AllStations = []
 
     ### Calculate Satellite Position
     for Station in PrepareData(True):
         StLocation  = Station['LocationData']
-        StMinDegree = Station['MinDegree']
+        StTimeZone  = pytz.timezone(StLocation['TimeZone'])
+        AllStations.append({
+            'EarthStationId':   Station['Id'],
+            'TimeZone':         StLocation['TimeZone'],
+            'CoverStart':       StTimeZone.localize(datetime.datetime.combine(dtLoopStart, datetime.time())),
+            'CoverEnd':         StTimeZone.localize(datetime.datetime.combine(dtLoopEnd + datetime.timedelta(days=1), datetime.time()))
+        })
+        StHorizon   = LoadHorizonMask(Station)
         StFollows   = {}
         StConflicts = []
 
@@ -585,9 +612,10 @@ def MainProcess():
                     dtStrDateTime = dtRefDateTime.strftime('%Y%m%d')
 
                     BaseName    = DataPath+'POS_'+dtStrDateTime+'_'+fixstr(Station['Name'])+'_'+fixstr(StationSat['SatName'])+'_'+StationSat['SatHash']
-                    SatPassages = CalcPassages(v_SatelliteData=StationSat,v_StationData=Station,v_dtRefDateTime=dtRefDateTime)
-                    jStationSatPassages = [jPassage for jPassage in SatPassages[1] if jPassage['Degress'] >= StMinDegree]
+                    SatPassages = CalcPassages(v_SatelliteData=StationSat,v_StationData=Station,v_dtRefDateTime=dtRefDateTime,v_HorizonMask=StHorizon)
+                    jStationSatPassages = SatPassages[1]
                     StFollows[StationSat['SatHash']][dtStrDateTime] = SatPassages[0]
+                    AllWindows.extend([dict(jWindow, EarthStationId=Station['Id'], EarthStationName=Station['Name']) for jWindow in SatPassages[0]])
 
                     if (StationSat['SatTrackingConfig']['Output_CSV']):
                         with open(os.path.realpath(BaseName+'.meta'),'w') as fCsvMetaFilePositions:
@@ -675,6 +703,10 @@ def MainProcess():
                     with open(os.path.realpath(ConflictsBaseName+'.json'),'w') as fJsonConflicts:
                         fJsonConflicts.write(json.dumps(StConflictsClean,sort_keys=True,indent=4))
 
+    ### Pass Index (All Stations And Days)
+    PassIndexName = DataPath+'IDX_'+dtLoopStart.strftime('%Y%m%d')+'_'+dtLoopEnd.strftime('%Y%m%d')+'.npz'
+    PyPassIndex.SavePassIndex(PyPassIndex.BuildPassIndex(AllWindows, AllStations), PassIndexName)
+
 
 def main():
     try:
@@ -0,0 +1,321 @@
+#!/usr/bin/python3
+# -*- coding: UTF-8 -*-
+###############################################################################
+# Module:   PyPassIndex.py          Autor: Felipe Almeida                     #
+# Start:    19-Oct-2026             LastUpdate: 19-Oct-2026     Version: 1.0  #
+###############################################################################
+
+import sys
+import os
+import glob
+import json
+import argparse
+import datetime
+import numpy
+import pytz
+
+ThisPath    = os.path.dirname(__file__)+'/'
+DataPath    = ThisPath+'data/'
+
+# Windows are kept as numpy arrays with numeric UTC timestamps:
+#   - Range/point queries use a nested containment list (NCList), globally and
+#     per station, stored as flat arrays. Each list holds intervals none of
+#     which contains another, so starts and ends are both sorted; a query is a
+#     searchsorted per visited list and only lists of reported windows are
+#     visited: O(log n + k * log n) worst case, O(log n + k) when windows do
+#     not nest (one long window only adds its own sublist to the search).
+#   - Per station, overlapping windows are merged into disjoint busy blocks
+#     whose starts and ends are both sorted, answering free/busy with two
+#     searchsorted calls plus the k blocks.
+#   - Every processed station is listed with its TimeZone and the UTC span the
+#     run covered; queries outside that span are rejected.
+StrFields   = ['EarthStationId', 'EarthStationName', 'StationId', 'SatName', 'TleName', 'TleHash', 'dtPassageDate', 'WindowStart', 'WindowEnd', 'SatApexTime']
+IntFields   = ['SatNum', 'WindowId']
+FloatFields = ['SatApexDegree']
+NcFields    = ['Items', 'Start', 'End', 'ChildStart', 'ChildEnd']
+
+
+def ParseTime(v_Time):
+    # Epoch seconds or ISO 8601 (datetime kept naive when no offset is given)
+    if isinstance(v_Time, (int, float, numpy.integer, numpy.floating, datetime.datetime)):
+        return v_Time
+    try:
+        return float(v_Time)
+    except ValueError:
+        return datetime.datetime.fromisoformat(v_Time)
+
+
+def ToTimestamp(v_Time, v_TimeZone=None):
+    # Naive times are read in v_TimeZone (the station's); without it they are rejected
+    Time = ParseTime(v_Time)
+    if not isinstance(Time, datetime.datetime):
+        return float(Time)
+    if (Time.tzinfo is None):
+        if not v_TimeZone:
+            raise ValueError('Time "'+Time.isoformat()+'" has no UTC offset and no EarthStation TimeZone applies')
+        Time = pytz.timezone(v_TimeZone).localize(Time)
+    return Time.timestamp()
+
+
+def FromTimestamp(v_Timestamp, v_TimeZone=None):
+    TimeZone = pytz.timezone(v_TimeZone) if v_TimeZone else datetime.timezone.utc
+    return datetime.datetime.fromtimestamp(float(v_Timestamp), TimeZone).isoformat(timespec='microseconds')
+
+
+def BuildNCList(v_TsStart, v_TsEnd, v_Indices, v_Base=0):
+    # Nested containment list over v_Indices, laid out breadth first with each
+    # sublist contiguous; positions are offset by v_Base for concatenation
+    Order   = sorted(v_Indices, key=lambda Idx:(v_TsStart[Idx], -v_TsEnd[Idx]))
+    Childs  = {-1: []}
+    Stack   = []
+    for Idx in Order:
+        while (len(Stack) and (v_TsEnd[Stack[-1]] < v_TsEnd[Idx])):
+            Stack.pop()
+        Childs[Stack[-1] if len(Stack) else -1].append(Idx)
+        Childs[Idx] = []
+        Stack.append(Idx)
+
+    jNcList = {Field:[] for Field in NcFields}
+    Ranges  = {}
+    Queue   = [-1]
+    for Node in Queue:
+        Ranges[Node] = (v_Base + len(jNcList['Items']), v_Base + len(jNcList['Items']) + len(Childs[Node]))
+        jNcList['Items'].extend(Childs[Node])
+        Queue.extend(Childs[Node])
+    for Idx in jNcList['Items']:
+        jNcList['Start'].append(v_TsStart[Idx])
+        jNcList['End'].append(v_TsEnd[Idx])
+        jNcList['ChildStart'].append(Ranges[Idx][0])
+        jNcList['ChildEnd'].append(Ranges[Idx][1])
+
+    return jNcList, Ranges[-1]
+
+
+def BuildPassIndex(v_Windows, v_EarthStations):
+    # v_Windows: SatPOSMetadata items plus 'EarthStationId' and 'EarthStationName';
+    # queries filter on EarthStationId, StationId is kept as the metadata has it.
+    # v_EarthStations: every processed station as {'EarthStationId', 'TimeZone',
+    # 'CoverStart', 'CoverEnd'}, the cover end being exclusive.
+    jStations = {jStation['EarthStationId']:jStation for jStation in v_EarthStations}
+    for jItem in v_Windows:
+        if not jItem['EarthStationId'] in jStations.keys():
+            raise ValueError('Window for EarthStation "'+str(jItem['EarthStationId'])+'" not listed in v_EarthStations')
+
+    Windows = sorted(v_Windows, key=lambda DictItem:(DictItem['EarthStationId'], ToTimestamp(DictItem['WindowStart'])))
+    jPassIndex = {}
+    for Field in StrFields:
+        jPassIndex[Field] = numpy.array([str(jItem[Field]) for jItem in Windows], dtype=str)
+    for Field in IntFields:
+        jPassIndex[Field] = numpy.array([jItem[Field] for jItem in Windows], dtype=numpy.int64)
+    for Field in FloatFields:
+        jPassIndex[Field] = numpy.array([jItem[Field] for jItem in Windows], dtype=numpy.float64)
+    jPassIndex['TsStart'] = numpy.array([ToTimestamp(jItem['WindowStart']) for jItem in Windows], dtype=numpy.float64)
+    jPassIndex['TsEnd']   = numpy.array([ToTimestamp(jItem['WindowEnd']) for jItem in Windows], dtype=numpy.float64)
+    TsStart = jPassIndex['TsStart'].tolist()
+    TsEnd   = jPassIndex['TsEnd'].tolist()
+
+    ### Stations (Including Those Without Passes)
+    Stations = numpy.array(sorted(jStations.keys()), dtype=str)
+    StationOffsets = numpy.append(numpy.searchsorted(jPassIndex['EarthStationId'], Stations, side='left'), len(Windows)).astype(numpy.int64)
+    jPassIndex['Stations']          = Stations
+    jPassIndex['StationOffsets']    = StationOffsets
+    jPassIndex['StationTimeZone']   = numpy.array([str(jStations[Station]['TimeZone']) for Station in Stations], dtype=str)
+    jPassIndex['StationCoverStart'] = numpy.array([ToTimestamp(jStations[Station]['CoverStart']) for Station in Stations], dtype=numpy.float64)
+    jPassIndex['StationCoverEnd']   = numpy.array([ToTimestamp(jStations[Station]['CoverEnd']) for Station in Stations], dtype=numpy.float64)
+
+    ### Global NCList
+    jNcList, NcRoot = BuildNCList(TsStart, TsEnd, range(len(Windows)))
+    for Field in NcFields:
+        jPassIndex['GlobalNc'+Field] = numpy.array(jNcList[Field], dtype=(numpy.int64 if Field not in ['Start', 'End'] else numpy.float64))
+    jPassIndex['GlobalNcRoot'] = numpy.array(NcRoot, dtype=numpy.int64)
+
+    ### Per Station NCLists And Merged Busy Blocks
+    jStNcList   = {Field:[] for Field in NcFields}
+    StNcRoots   = []
+    BusyStart   = []
+    BusyEnd     = []
+    BusyOffsets = [0]
+    for StIdx in range(len(Stations)):
+        First, Last = int(StationOffsets[StIdx]), int(StationOffsets[StIdx + 1])
+        jNcList, NcRoot = BuildNCList(TsStart, TsEnd, range(First, Last), len(jStNcList['Items']))
+        for Field in NcFields:
+            jStNcList[Field].extend(jNcList[Field])
+        StNcRoots.append(NcRoot)
+        for WinStart, WinEnd in zip(TsStart[First:Last], TsEnd[First:Last]):
+            if ((len(BusyStart) > BusyOffsets[-1]) and (WinStart <= BusyEnd[-1])):
+                BusyEnd[-1] = max(BusyEnd[-1], WinEnd)
+            else:
+                BusyStart.append(WinStart)
+                BusyEnd.append(WinEnd)
+        BusyOffsets.append(len(BusyStart))
+
+    for Field in NcFields:
+        jPassIndex['StationNc'+Field] = numpy.array(jStNcList[Field], dtype=(numpy.int64 if Field not in ['Start', 'End'] else numpy.float64))
+    jPassIndex['StationNcRoot'] = numpy.array(StNcRoots, dtype=numpy.int64).reshape(-1, 2)
+    jPassIndex['BusyStart']     = numpy.array(BusyStart, dtype=numpy.float64)
+    jPassIndex['BusyEnd']       = numpy.array(BusyEnd, dtype=numpy.float64)
+    jPassIndex['BusyOffsets']   = numpy.array(BusyOffsets, dtype=numpy.int64)
+
+    return jPassIndex
+
+
+def SavePassIndex(v_PassIndex, v_FileName):
+    with open(os.path.realpath(v_FileName), 'wb') as fPassIndex:
+        numpy.savez(fPassIndex, **v_PassIndex)
+
+
+def LoadPassIndex(v_FileName):
+    with numpy.load(os.path.realpath(v_FileName), allow_pickle=False) as npPassIndex:
+        return {key:npPassIndex[key] for key in npPassIndex.files}
+
+
+def PassIndexItem(v_PassIndex, v_Idx):
+    jItem = {}
+    for Field in StrFields:
+        jItem[Field] = str(v_PassIndex[Field][v_Idx])
+    for Field in IntFields:
+        jItem[Field] = int(v_PassIndex[Field][v_Idx])
+    for Field in FloatFields:
+        jItem[Field] = float(v_PassIndex[Field][v_Idx])
+    return jItem
+
+
+def StationSlice(v_PassIndex, v_EarthStationId):
+    StIdx = int(numpy.searchsorted(v_PassIndex['Stations'], v_EarthStationId))
+    if ((StIdx >= len(v_PassIndex['Stations'])) or (v_PassIndex['Stations'][StIdx] != v_EarthStationId)):
+        raise ValueError('Unknown EarthStation "'+str(v_EarthStationId)+'" in pass index')
+    return StIdx
+
+
+def QueryRange(v_PassIndex, v_TimeStart, v_TimeEnd, v_EarthStationId=None, v_Strict=False):
+    # Validates the range against the covered span; returns (TsStart, TsEnd, StIdx, TimeZone)
+    StIdx = None
+    TimeZone = None
+    if (v_EarthStationId is None):
+        CoverStart = numpy.max(v_PassIndex['StationCoverStart'], initial=-numpy.inf)
+        CoverEnd   = numpy.min(v_PassIndex['StationCoverEnd'], initial=numpy.inf)
+    else:
+        StIdx      = StationSlice(v_PassIndex, v_EarthStationId)
+        TimeZone   = str(v_PassIndex['StationTimeZone'][StIdx])
+        CoverStart = v_PassIndex['StationCoverStart'][StIdx]
+        CoverEnd   = v_PassIndex['StationCoverEnd'][StIdx]
+
+    TsStart = ToTimestamp(v_TimeStart, TimeZone)
+    TsEnd   = ToTimestamp(v_TimeEnd, TimeZone)
+    if ((TsStart > TsEnd) or (v_Strict and (TsStart == TsEnd))):
+        raise ValueError('Range start '+FromTimestamp(TsStart, TimeZone)+' is '+('not before' if v_Strict else 'after')+' range end '+FromTimestamp(TsEnd, TimeZone))
+    if (len(v_PassIndex['Stations']) == 0) or (TsStart < CoverStart) or (TsEnd > CoverEnd):
+        CoverStr = 'nothing' if (len(v_PassIndex['Stations']) == 0) or (CoverStart >= CoverEnd) else FromTimestamp(CoverStart, TimeZone)+' to '+FromTimestamp(CoverEnd, TimeZone)
+        raise ValueError('Range '+FromTimestamp(TsStart, TimeZone)+' to '+FromTimestamp(TsEnd, TimeZone)+' is outside the pass index cover ('+CoverStr+')')
+
+    return TsStart, TsEnd, StIdx, TimeZone
+
+
+def QueryPassIndexRange(v_PassIndex, v_TimeStart, v_TimeEnd, v_EarthStationId=None):
+    # Windows overlapping [v_TimeStart, v_TimeEnd] (bounds inclusive)
+    TsStart, TsEnd, StIdx, TimeZone = QueryRange(v_PassIndex, v_TimeStart, v_TimeEnd, v_EarthStationId)
+    Prefix = 'GlobalNc' if StIdx is None else 'StationNc'
+    NcRoot = v_PassIndex['GlobalNcRoot'] if StIdx is None else v_PassIndex['StationNcRoot'][StIdx]
+    NcItems, NcStart, NcEnd = v_PassIndex[Prefix+'Items'], v_PassIndex[Prefix+'Start'], v_PassIndex[Prefix+'End']
+    NcChildStart, NcChildEnd = v_PassIndex[Prefix+'ChildStart'], v_PassIndex[Prefix+'ChildEnd']
+
+    Found = []
+    Lists = [(int(NcRoot[0]), int(NcRoot[1]))]
+    while len(Lists):
+        ListStart, ListEnd = Lists.pop()
+        Pos = ListStart + int(numpy.searchsorted(NcEnd[ListStart:ListEnd], TsStart, side='left'))
+        while ((Pos < ListEnd) and (NcStart[Pos] <= TsEnd)):
+            Found.append(int(NcItems[Pos]))
+            if (NcChildEnd[Pos] > NcChildStart[Pos]):
+                Lists.append((int(NcChildStart[Pos]), int(NcChildEnd[Pos])))
+            Pos += 1
+
+    Found.sort(key=lambda Idx:(v_PassIndex['TsStart'][Idx], Idx))
+    return [PassIndexItem(v_PassIndex, Idx) for Idx in Found]
+
+
+def QueryPassIndexAt(v_PassIndex, v_Time, v_EarthStationId=None):
+    # Satellites above the station(s) at v_Time
+    return QueryPassIndexRange(v_PassIndex, v_Time, v_Time, v_EarthStationId)
+
+
+def QueryStationFreeBusy(v_PassIndex, v_EarthStationId, v_TimeStart, v_TimeEnd):
+    # Busy blocks are the parts of merged windows inside (v_TimeStart, v_TimeEnd);
+    # a block only touching a bound is not busy time within the range
+    TsStart, TsEnd, StIdx, TimeZone = QueryRange(v_PassIndex, v_TimeStart, v_TimeEnd, v_EarthStationId, True)
+    Offset      = int(v_PassIndex['BusyOffsets'][StIdx])
+    OffsetEnd   = int(v_PassIndex['BusyOffsets'][StIdx + 1])
+    BusyStart   = v_PassIndex['BusyStart'][Offset:OffsetEnd]
+    BusyEnd     = v_PassIndex['BusyEnd'][Offset:OffsetEnd]
+    First       = int(numpy.searchsorted(BusyEnd, TsStart, side='right'))
+    Last        = int(numpy.searchsorted(BusyStart, TsEnd, side='left'))
+    ClipStart   = numpy.maximum(BusyStart[First:Last], TsStart)
+    ClipEnd     = numpy.minimum(BusyEnd[First:Last], TsEnd)
+
+    jFreeBusy = {
+        'EarthStationId':   v_EarthStationId,
+        'TimeZone':         TimeZone,
+        'TimeStart':        FromTimestamp(TsStart, TimeZone),
+        'TimeEnd':          FromTimestamp(TsEnd, TimeZone),
+        'Busy':             [],
+        'Free':             [],
+        'IsFree':           (len(ClipStart) == 0)
+    }
+    FreeStart = TsStart
+    for BusyFrom, BusyTo in zip(ClipStart, ClipEnd):
+        jFreeBusy['Busy'].append({'WindowStart': FromTimestamp(BusyFrom, TimeZone), 'WindowEnd': FromTimestamp(BusyTo, TimeZone)})
+        if (BusyFrom > FreeStart):
+            jFreeBusy['Free'].append({'WindowStart': FromTimestamp(FreeStart, TimeZone), 'WindowEnd': FromTimestamp(BusyFrom, TimeZone)})
+        FreeStart = BusyTo
+    if (FreeStart < TsEnd):
+        jFreeBusy['Free'].append({'WindowStart': FromTimestamp(FreeStart, TimeZone), 'WindowEnd': FromTimestamp(TsEnd, TimeZone)})
+
+    return jFreeBusy
+
+
+def LatestPassIndexFile():
+    global DataPath
+
+    IndexFiles = sorted(glob.glob(DataPath+'IDX_*.npz'), key=os.path.getmtime)
+    return IndexFiles[-1] if len(IndexFiles) else None
+
+
+def main():
+    Parser = argparse.ArgumentParser(description='Query the pass index saved by PyOrbitalFollow (times as ISO 8601 or epoch seconds; times without UTC offset are read in the EarthStation TimeZone and need a station)')
+    Parser.add_argument('--index', default=None, help='Pass index file (default: newest data/IDX_*.npz)')
+    SubParsers = Parser.add_subparsers(dest='Command', required=True)
+    ParserAt = SubParsers.add_parser('at', help='Satellites above station(s) at a given time')
+    ParserAt.add_argument('time', type=ParseTime)
+    ParserAt.add_argument('--station', default=None, help='EarthStation Id')
+    ParserRange = SubParsers.add_parser('range', help='Passes overlapping a time range')
+    ParserRange.add_argument('start', type=ParseTime)
+    ParserRange.add_argument('end', type=ParseTime)
+    ParserRange.add_argument('--station', default=None, help='EarthStation Id')
+    ParserFree = SubParsers.add_parser('free', help='Free/busy blocks of a station in a time range')
+    ParserFree.add_argument('station', help='EarthStation Id')
+    ParserFree.add_argument('start', type=ParseTime)
+    ParserFree.add_argument('end', type=ParseTime)
+    Args = Parser.parse_args()
+
+    IndexFile = Args.index if Args.index is not None else LatestPassIndexFile()
+    if (IndexFile is None):
+        print('No pass index found in "'+os.path.realpath(DataPath)+'"')
+        sys.exit(1)
+    jPassIndex = LoadPassIndex(IndexFile)
+
+    try:
+        if (Args.Command == 'at'):
+            jResult = QueryPassIndexAt(jPassIndex, Args.time, Args.station)
+        elif (Args.Command == 'range'):
+            jResult = QueryPassIndexRange(jPassIndex, Args.start, Args.end, Args.station)
+        else:
+            jResult = QueryStationFreeBusy(jPassIndex, Args.station, Args.start, Args.end)
+    except ValueError as Error:
+        print(str(Error))
+        sys.exit(1)
+    print(json.dumps(jResult, sort_keys=True, indent=4))
+    sys.exit(0)
+
+
+if __name__ == "__main__":
+    main()